@@ -1,12 +1,129 @@
-from pylab import *
+import argparse
+
+import numpy as np
+from numpy import pi, sin
 from mpl_toolkits.mplot3d import Axes3D
 from matplotlib import cm
+from scipy.sparse import diags
 import matplotlib.pyplot as plt
 import matplotlib.animation as animation
 
+try:
+    from numba import njit, prange
+    HAVE_NUMBA = True
+except ImportError:
+    # numba is optional, without it both wave_step_loop and
+    # wave_step_loop_parallel fall back to wave_step_loop_numpy below
+    HAVE_NUMBA = False
+
+    def njit(*args, **kwargs):
+        return lambda func: func
+
+    prange = range
+
+
+# explicit signatures compile both precisions of the serial kernel at import
+# (or load them from the cache) instead of on the first solve. the parallel
+# kernel only runs on large grids and stays lazy, compiling its parfors for
+# both dtypes up front would multiply the cold import time
+WAVE_STEP_SIGNATURES = [
+    'void(float32[:, ::1], float32[::1], int64, float32, int64, float32, float32)',
+    'void(float64[:, ::1], float64[::1], int64, float64, int64, float64, float64)',
+]
+
+
+@njit(WAVE_STEP_SIGNATURES, cache=True, fastmath=True)
+def wave_step_loop(snapshots, u_prev, stride, sigma, nt, b_left, b_right):
+    # snapshots[:, 0] is u at t = 0 and u_prev the step before it. the march
+    # runs on three rolling Nx buffers that stay in cache, and every
+    # stride-th step is copied out into the next snapshot column
+    nx = snapshots.shape[0]
+    two_one_minus_sigma = 2 * (1 - sigma)
+    u_prev = u_prev.copy()
+    u_curr = snapshots[:, 0].copy()
+    u_next = np.empty_like(u_curr)
+    # the dirichlet values are constant, so they are written into all three
+    # buffers once and the loop only updates the interior
+    for buf in (u_prev, u_curr, u_next):
+        buf[0] = b_left
+        buf[nx - 1] = b_right
+    for n in range(nt):
+        for j in range(1, nx - 1):
+            u_next[j] = sigma * (u_curr[j - 1] + u_curr[j + 1]) + two_one_minus_sigma * u_curr[j] - u_prev[j]
+        if (n + 1) % stride == 0:
+            snapshots[:, (n + 1) // stride] = u_next
+        u_prev, u_curr, u_next = u_curr, u_next, u_prev
+
+
+# below this many grid points the prange fork/join costs more than the
+# interior update itself, so the serial kernel is used
+PARALLEL_MIN_NX = 2048
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def wave_step_loop_parallel(snapshots, u_prev, stride, sigma, nt, b_left, b_right):
+    # same march as wave_step_loop, time stays serial and the interior of
+    # each step is split across cores. the three buffers are rows of one
+    # array picked by n % 3, rebinding arrays around a prange loop is not
+    # safe under the parfor transform
+    nx = snapshots.shape[0]
+    two_one_minus_sigma = 2 * (1 - sigma)
+    buf = np.empty((3, nx), dtype=snapshots.dtype)
+    buf[0] = u_prev
+    buf[1] = snapshots[:, 0]
+    buf[:, 0] = b_left
+    buf[:, nx - 1] = b_right
+    for n in range(nt):
+        prev = n % 3
+        curr = (n + 1) % 3
+        nxt = (n + 2) % 3
+        for j in prange(1, nx - 1):
+            buf[nxt, j] = sigma * (buf[curr, j - 1] + buf[curr, j + 1]) + two_one_minus_sigma * buf[curr, j] \
+                - buf[prev, j]
+        if (n + 1) % stride == 0:
+            snapshots[:, (n + 1) // stride] = buf[nxt]
+
+
+def wave_step_loop_numpy(snapshots, u_prev, stride, sigma, nt, b_left, b_right):
+    # wave_step_loop as numpy slice arithmetic, used when numba is not installed
+    # promote sigma so the coefficients are float64 like wave_step_loop
+    sigma = np.float64(sigma)
+    two_one_minus_sigma = 2 * (1 - sigma)
+    u_prev = u_prev.copy()
+    u_curr = snapshots[:, 0].copy()
+    u_next = np.empty_like(u_curr)
+    for buf in (u_prev, u_curr, u_next):
+        buf[0] = b_left
+        buf[-1] = b_right
+    for n in range(nt):
+        u_next[1:-1] = sigma * (u_curr[:-2] + u_curr[2:]) + two_one_minus_sigma * u_curr[1:-1] - u_prev[1:-1]
+        if (n + 1) % stride == 0:
+            snapshots[:, (n + 1) // stride] = u_next
+        u_prev, u_curr, u_next = u_curr, u_next, u_prev
+
+
+if not HAVE_NUMBA:
+    wave_step_loop = wave_step_loop_parallel = wave_step_loop_numpy
+
+
+def wave_sigma(beta_square, delta_t, delta_x):
+    # works on arrays as well, wave_sigma(...) <= 1 is the stability mask
+    # for a sweep over delta_t / delta_x
+    return ((np.sqrt(beta_square) * delta_t) / delta_x) ** 2
+
+
+def evaluate_on_grid(func, x):
+    # func is called once on the whole grid, callables that only work on
+    # scalars fall back to np.vectorize and constants are broadcast
+    try:
+        values = func(x)
+    except (TypeError, ValueError):
+        values = np.vectorize(func, otypes=[float])(x)
+    return np.broadcast_to(values, x.shape)
+
 
 class WaveEquation(object):
-    def __init__(self, L, T, u0t, u1t, beta_square, delta_t, delta_x, g, f):
+    def __init__(self, L, T, u0t, u1t, beta_square, delta_t, delta_x, g, f, dtype=np.float32):
 
         self.L = L
         self.T = T
@@ -17,14 +134,24 @@ class WaveEquation(object):
         self.delta_x = delta_x
         self.g = g
         self.f = f
+        # float32 by default, pass dtype=np.float64 for convergence studies.
+        # the kernels are only compiled for these two
+        self.dtype = np.dtype(dtype)
+        if self.dtype not in (np.float32, np.float64):
+            raise ValueError(f"dtype must be float32 or float64, got {self.dtype}")
         self.Nt = int(self.T / self.delta_t) + 1
         self.Nx = int(self.L / self.delta_x) + 1
-        self.sigma = ((sqrt(self.beta_square) * self.delta_t) / self.delta_x) ** 2
+        self.sigma = wave_sigma(self.beta_square, self.delta_t, self.delta_x)
+        # initial position f and velocity g are sampled on the grid once
+        self.x = np.arange(self.Nx) * self.delta_x
+        self.f_values = evaluate_on_grid(self.f, self.x)
+        self.g_values = evaluate_on_grid(self.g, self.x)
         self.u_bound = np.zeros(self.Nx)
         # self.u_bound[0] = self.u0t(0)
         self.u_bound[0] = self.u0t
         self.u_bound[-1] = self.u1t
-        self.A = self.tri_diagonal_matrix()
+        # the solver applies the stencil directly, tri_diagonal_matrix() is
+        # still there for anyone who wants the operator itself
 
         # for t in range(1, self.Nt):
         #     print(f" result of u0t: {self.u0t(t * self.delta_t)}")
@@ -33,21 +160,36 @@ class WaveEquation(object):
         #     self.u_matrix[-1, t] = self.u1t(t * self.delta_t)
 
         """Q1"""
-        self.u_matrix = self.initial_condition_matrix()
-        self.u_matrix[0, :] = self.u_bound[0]
-        self.u_matrix[-1, :] = self.u_bound[-1]
-
-    def initial_condition_matrix(self):
-
-        u = np.zeros((self.Nx, self.Nt + 1))
-        for i in range(self.Nx):
-            # print(f"i = {i}")
-            # print(f"delta x : {self.delta_x}")
-            u[i, 0] = self.f(i * self.delta_x)
+        # only the t = 0 column is kept until a solve, the solver allocates
+        # just the snapshot columns it is asked for
+        self.u0 = self.initial_condition_vector()
+        self.u0[0] = self.u_bound[0]
+        self.u0[-1] = self.u_bound[-1]
+        self.u_matrix = self.u0[:, np.newaxis]
+        # stride of the last solve, repeated calls with the same stride reuse it
+        self.snapshot_stride = None
+
+    def invalidate(self):
+        # the memo above only looks at the stride, call this after changing
+        # u0, g_values, sigma or the boundary values so the next
+        # wave_equation_solver call solves again
+        self.snapshot_stride = None
+
+    def initial_condition_vector(self):
+
+        # float32 storage by default
+        u = np.array(self.f_values, dtype=self.dtype)
 
         # print(f"u: {u}")
         return u
 
+    def initial_condition_matrix(self):
+        # the old full (Nx, Nt + 1) layout with u0 in the first column, the
+        # solver itself no longer needs it
+        u = np.zeros((self.Nx, self.Nt + 1), dtype=self.dtype)
+        u[:, 0] = self.u0
+        return u
+
     def print_matrix(self):
         print(self.u_matrix.shape)
         return self.u_matrix
@@ -66,34 +208,42 @@ class WaveEquation(object):
 
     def tri_diagonal_matrix(self):
 
-        A = zeros((self.Nx, self.Nx))
-        A[0, 0] = 1
-        A[-1, -1] = 1
-        for i in range(1, self.Nx - 1):
-            A[i, i] = 2 * (1 - self.sigma)
-            A[i, i - 1] = self.sigma
-            A[i, i + 1] = self.sigma
+        main = np.full(self.Nx, 2 * (1 - self.sigma))
+        upper = np.full(self.Nx - 1, self.sigma)
+        lower = np.full(self.Nx - 1, self.sigma)
+        main[0] = main[-1] = 1
+        upper[0] = 0
+        lower[-1] = 0
 
-        return A
+        return diags([lower, main, upper], [-1, 0, 1], format='csr')
 
-    def wave_equation_solver(self):
+    def wave_equation_solver(self, snapshot_stride=1):
+        # only every snapshot_stride-th time step is kept in u_matrix, the
+        # default keeps all Nt + 1 of them
+        if snapshot_stride < 1:
+            raise ValueError(f"snapshot_stride must be at least 1, got {snapshot_stride}")
+        if self.snapshot_stride == snapshot_stride:
+            return self.u_matrix
 
-        u_curr = self.u_matrix[:, 0]
+        u_curr = self.u0
         print(f"u_curr: {u_curr}")
 
-        u_prev = np.zeros(self.Nx)
+        # ghost step before t = 0 from the taylor expansion, one slice
+        # expression over the interior instead of a python loop per point
+        u_prev = np.empty(self.Nx, dtype=self.dtype)
+        u_prev[1:-1] = u_curr[1:-1] - self.delta_t * self.g_values[1:-1] + 0.5 * self.sigma * (
+                u_curr[:-2] - 2 * u_curr[1:-1] + u_curr[2:])
         u_prev[0] = self.u0t
         u_prev[-1] = self.u1t
-        for i in range(1, self.Nx - 1):
-            u_prev[i] = u_curr[i] - self.delta_t * self.g(i * self.delta_x) + 0.5 * self.sigma * (
-                    u_curr[i - 1] - 2 * u_curr[i] + u_curr[i + 1])
 
         # print(f"u_prev: {u_prev}")
-        for n in range(0, self.Nt):
-            u_next = np.dot(self.A, u_curr) - u_prev
-            self.u_matrix[:, n + 1] = u_next
-            u_prev = u_curr
-            u_curr = u_next
+        dtype = self.dtype.type
+        snapshots = np.empty((self.Nx, self.Nt // snapshot_stride + 1), dtype=self.dtype)
+        snapshots[:, 0] = self.u0
+        step_loop = wave_step_loop_parallel if self.Nx > PARALLEL_MIN_NX else wave_step_loop
+        step_loop(snapshots, u_prev, snapshot_stride, dtype(self.sigma), self.Nt, dtype(self.u0t), dtype(self.u1t))
+        self.u_matrix = snapshots
+        self.snapshot_stride = snapshot_stride
 
         return self.u_matrix
         # for n in range(1, self.Nt):
@@ -103,25 +253,41 @@ class WaveEquation(object):
 
         # initial condition
 
+    def energy_over_time(self):
+        return np.einsum('ij,ij->j', self.u_matrix, self.u_matrix, dtype=np.float64, optimize=True) * self.delta_x
+
     def plot_3d(self):
 
         X = np.arange(0, self.Nx, 1)
-        Y = np.arange(0, self.Nt + 1, 1)
-        X, Y = np.meshgrid(X, Y)
-        Z = self.u_matrix[X, Y]
+        Y = np.arange(0, self.u_matrix.shape[1], 1)
+        # plot_surface broadcasts the sparse row/column grids itself
+        X, Y = np.meshgrid(X, Y, sparse=True)
+        # transposed view, same values as u_matrix[X, Y] without the copy
+        Z = self.u_matrix.T
 
         fig = plt.figure()
         ax = fig.add_subplot(111, projection='3d')
         surf = ax.plot_surface(X, Y, Z, cmap=cm.coolwarm, linewidth=0, antialiased=False)
         fig.colorbar(surf, shrink=0.5, aspect=5)
         plt.show()
+        # figures are closed once shown so their data is not kept alive
+        plt.close(fig)
 
-    def plot_2d(self):
-        for i in range(self.Nt):
-            plt.plot(self.u_matrix[:, i])
+    def plot_2d(self, stride=20):
+        # one line per stride time steps, a Line2D per step is what made
+        # this plot slow, the columns are drawn in a single plot call
+        fig = plt.figure()
+        plt.plot(self.u_matrix[:, :-1:stride])
         plt.show()
-
-    def animate(self):
+        plt.close(fig)
+
+    def animate(self, max_frames=500):
+        # drawing every time step gives far more frames than can be shown,
+        # at most max_frames evenly spaced columns are animated
+        n = self.u_matrix.shape[1]
+        frames = np.linspace(0, n - 1, min(n, max_frames)).astype(int)
+        # the x axis is the same for every frame, built once here
+        x = np.linspace(0, self.L, self.Nx)
         fig = plt.figure()
         ax = plt.axes(xlim=(0, self.L), ylim=(-1, 1))
         line, = ax.plot([], [], lw=2)
@@ -131,17 +297,22 @@ class WaveEquation(object):
             return line,
 
         def animate(i):
-            x = np.linspace(0, self.L, self.Nx)
             y = self.u_matrix[:, i]
             line.set_data(x, y)
             return line,
 
         anim = animation.FuncAnimation(fig, animate, init_func=init,
-                                       frames=self.Nt, interval=20, blit=True)
+                                       frames=frames, interval=20, blit=True, cache_frame_data=False)
         plt.show()
+        plt.close(fig)
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Wave equation Q1")
+    parser.add_argument("--plot", action="store_true", help="show the 3D, 2D and animated plots")
+    parser.add_argument("--stride", type=int, default=20, help="draw every stride-th time step in the 2D plot")
+    args = parser.parse_args()
+
     # def u0t(t):
     #     return 0
 
@@ -184,12 +355,13 @@ if __name__ == '__main__':
 
     # wave.plot_3d()
 
-    wave.initial_condition_matrix()
     sol = wave.wave_equation_solver()
     # print(f"giving me the answer? {sol}")
-    wave.plot_3d()
-    wave.plot_2d()
-    wave.animate()
+    # plotting dominates the run time, so it only happens with --plot
+    if args.plot:
+        wave.plot_3d()
+        wave.plot_2d(args.stride)
+        wave.animate()
 
     print(f"wave delta x: {wave.delta_x}")
     print(f"wave delta t: {wave.delta_t}")
@@ -8,6 +8,22 @@ import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d import Axes3D
 from matplotlib import cm
 from matplotlib import animation as animation
+import argparse
+
+try:
+    from numba import njit
+    HAVE_NUMBA = True
+except ImportError:
+    # numba is optional, without it step runs as step_numpy below
+    HAVE_NUMBA = False
+
+    def njit(*args, **kwargs):
+        return lambda func: func
+
+parser = argparse.ArgumentParser(description="Wave equation Q2: u(0, t) = sin(t), u(1, t) = 0")
+parser.add_argument("--plot", action="store_true", help="show the 3D, 2D and animated plots")
+parser.add_argument("--stride", type=int, default=20, help="draw every stride-th time step in the 2D plot")
+args = parser.parse_args()
 
 L = 1.0
 T = 2 * np.pi
@@ -35,72 +51,67 @@ Nt = int(T / dt) + 1
 # x = np.linspace(0, L, Nx)
 # t = np.linspace(0, T, Nt)
 
-u = np.zeros((Nx, Nt + 1))
+# float32 storage
+u = np.zeros((Nx, Nt + 1), dtype=np.float32)
 
-for i in range(Nt):
-    t = i * dt
-    u[0, i] = np.sin(t)
-    u[-1, i] = 0
+# boundary values for every stored column, including the last one the
+# time loop writes
+t = np.arange(Nt + 1) * dt
+u[0, :] = np.sin(t)
+u[-1, :] = 0
 
 # print(f"u: {u}")
 # print(f"u shape: {u.shape}")
-# set up tri-diagonal matrix
-
-A = np.zeros((Nx, Nx))
-A[0, 0] = 1
-A[-1, -1] = 1
-for i in range(1, Nx - 1):
-    A[i, i - 1] = sigma
-    A[i, i] = 2 - 2 * sigma
-    A[i, i + 1] = sigma
-# print(f"A: {A}")
-# print(f"A shape: {A.shape}")
+# the tri-diagonal operator is applied as a 3-point stencil on slices
+# below, so no (Nx, Nx) matrix is stored
 
 # solve for u
 
-u_prev = np.zeros(Nx)
+u_prev = np.zeros(Nx, dtype=np.float32)
 u_curr = u[:, 1]
 # print(f"u_curr: {u_curr}")
 
-for i in range(1, Nx - 1):
-    u_prev[i] = u_curr[i] + 0.5 * sigma * (u_curr[i + 1] - 2 * u_curr[i] + u_curr[i - 1])
+u_prev[1:-1] = u_curr[1:-1] + 0.5 * sigma * (u_curr[2:] - 2 * u_curr[1:-1] + u_curr[:-2])
 
 # print(f"u_prev: {u_prev}")
-bdry = u.copy()
 
-for i in range(1, Nt):
-    # print(f"boundary condition: {u[0, i]}")
-    u_next = A.dot(u_curr) + sigma * bdry[:, i] - u_prev
-    # print(f"u_next: {u_next}")
-    u[:, i + 1] = u_next
-    u_prev = u_curr
-    u_curr = u_next
 
-# print(f"u: {u}")
+# compiled time stepping, serial since the grid is small
+@njit(fastmath=True, cache=True)
+def step(u, u_prev, u_curr, sigma, Nx, Nt):
+    for n in range(1, Nt):
+        u_next = u[:, n + 1]
+        for i in range(1, Nx - 1):
+            u_next[i] = (2 - 2 * sigma) * u_curr[i] + sigma * (u_curr[i + 1] + u_curr[i - 1]) - u_prev[i]
+        u_prev = u_curr
+        u_curr = u_next
+    return u
 
-# plot 3d graph
 
-X = np.arange(0, Nx, 1)
-Y = np.arange(0, Nt + 1, 1)
-X, Y = np.meshgrid(X, Y)
-Z = u[X, Y]
+def step_numpy(u, u_prev, u_curr, sigma, Nx, Nt):
+    # step as numpy slice arithmetic, used when numba is not installed
+    # promote sigma so the coefficients are float64 like step
+    sigma = np.float64(sigma)
+    for n in range(1, Nt):
+        u_next = u[:, n + 1]
+        u_next[1:-1] = (2 - 2 * sigma) * u_curr[1:-1] + sigma * (u_curr[2:] + u_curr[:-2]) - u_prev[1:-1]
+        u_prev = u_curr
+        u_curr = u_next
+    return u
 
-# store data in file
 
-fig = plt.figure()
-ax = fig.add_subplot(111, projection='3d')
-surf = ax.plot_surface(X, Y, Z, cmap=cm.coolwarm, linewidth=0, antialiased=False)
-fig.colorbar(surf, shrink=0.5, aspect=5)
-plt.show()
+if not HAVE_NUMBA:
+    step = step_numpy
 
-# plot 2d graph
+u = step(u, u_prev, u_curr.copy(), np.float32(sigma), Nx, Nt)
 
-for i in range(Nt):
-    plt.plot(u[:, i])
-plt.show()
+# print(f"u: {u}")
 
 # animate
-def animate():
+def animate(max_frames=500):
+    # at most max_frames evenly spaced time steps, not one frame per step
+    frames = np.linspace(0, Nt - 1, min(Nt, max_frames)).astype(int)
+    x = np.linspace(0, Nx, Nx)
     fig = plt.figure()
     ax = plt.axes(xlim=(0, Nx), ylim=(-1, 1))
     line, = ax.plot([], [], lw=2)
@@ -110,12 +121,40 @@ def animate():
         return line,
 
     def animate(i):
-        x = np.linspace(0, Nx, Nx)
         y = u[:, i]
         line.set_data(x, y)
         return line,
 
-    anim = animation.FuncAnimation(fig, animate, init_func=init, frames=Nt, interval=10, blit=True)
+    anim = animation.FuncAnimation(fig, animate, init_func=init, frames=frames, interval=10, blit=True,
+                                   cache_frame_data=False)
+    plt.show()
+    plt.close(fig)
+
+
+# plots only with --plot
+if args.plot:
+    # plot 3d graph
+
+    X = np.arange(0, Nx, 1)
+    Y = np.arange(0, Nt + 1, 1)
+    X, Y = np.meshgrid(X, Y, sparse=True)
+    # transposed view, same values as u[X, Y] without the copy
+    Z = u.T
+
+    # store data in file
+
+    fig = plt.figure()
+    ax = fig.add_subplot(111, projection='3d')
+    surf = ax.plot_surface(X, Y, Z, cmap=cm.coolwarm, linewidth=0, antialiased=False)
+    fig.colorbar(surf, shrink=0.5, aspect=5)
+    plt.show()
+    plt.close(fig)
+
+    # plot 2d graph, one line per stride time steps instead of one per step
+
+    fig = plt.figure()
+    plt.plot(u[:, :Nt:args.stride])
     plt.show()
+    plt.close(fig)
 
-animate()
+    animate()
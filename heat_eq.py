@@ -1,8 +1,70 @@
-from pylab import *
+from functools import cached_property
+
+import numpy as np
+from scipy.linalg import get_lapack_funcs
+from scipy.sparse import diags
+
+try:
+    from numba import njit
+    HAVE_NUMBA = True
+except ImportError:
+    # numba is optional, without it heat_step is replaced by
+    # heat_step_numpy below
+    HAVE_NUMBA = False
+
+    def njit(*args, **kwargs):
+        return lambda func: func
+
+
+def tri_diag_operator(n, sigma):
+    main = np.full(n, 1 - 2 * sigma)
+    upper = np.full(n - 1, sigma)
+    lower = np.full(n - 1, sigma)
+    # boundary rows stay fixed, written into the diagonals so the matrix is
+    # built as CSR in one go instead of edited afterwards
+    main[0] = main[n - 1] = 1
+    upper[0] = 0
+    lower[n - 2] = 0
+    return diags([lower, main, upper], [-1, 0, 1], format='csr', dtype=np.float32)
+
+
+@njit(cache=True, fastmath=True)
+def heat_step(u, u_out, sigma, b_left, b_right):
+    # one explicit step of the 3-point stencil written straight into u_out,
+    # O(N) per step and no operator matrix needed
+    n = u.shape[0]
+    u_out[0] = b_left
+    for i in range(1, n - 1):
+        u_out[i] = sigma * u[i - 1] + (1 - 2 * sigma) * u[i] + sigma * u[i + 1]
+    u_out[n - 1] = b_right
+
+
+def heat_step_numpy(u, u_out, sigma, b_left, b_right):
+    # heat_step as numpy slice arithmetic, used when numba is not installed
+    # promote sigma so the coefficients are float64 like heat_step
+    sigma = np.float64(sigma)
+    u_out[0] = b_left
+    u_out[1:-1] = sigma * (u[:-2] + u[2:]) + (1 - 2 * sigma) * u[1:-1]
+    u_out[-1] = b_right
+
+
+if not HAVE_NUMBA:
+    heat_step = heat_step_numpy
+
+
+SCHEMES = ('explicit', 'crank_nicolson')
+
+
+def heat_sigma(beta, delta_t, delta_x):
+    # plain arithmetic so arrays of delta_t / delta_x give one sigma per pair,
+    # heat_sigma(...) < 0.5 is then the stability mask for a whole sweep
+    return beta * delta_t / (delta_x ** 2)
 
 
 class HeatEquation(object):
-    def __init__(self, L, T, b0t, b1t, beta, delta_t, delta_x, u_0):
+    def __init__(self, L, T, b0t, b1t, beta, delta_t, delta_x, u_0, scheme='explicit'):
+        if scheme not in SCHEMES:
+            raise ValueError(f"scheme must be one of {SCHEMES}, got {scheme!r}")
         # initial and boundary condition
         self.L = L
         self.T = T
@@ -12,14 +74,19 @@ class HeatEquation(object):
         self.delta_t = delta_t
         self.delta_x = delta_x
         self.u_0 = u_0
+        self.scheme = scheme
         # length of time array
         self.len_t = int((self.T / self.delta_t) + 1)
         #self.N = int((self.L / self.delta_x) + 1)
         self.N = int((self.L / self.delta_x) + 1)
-        self.sigma = self.beta * self.delta_t / (self.delta_x ** 2)
+        self.sigma = heat_sigma(self.beta, self.delta_t, self.delta_x)
         # self.sigma_checker()
-        # create tri-diagonal matrix
-        self.A = self.create_tri_diag()
+        # the explicit solver steps with heat_step, the tri-diagonal matrix A
+        # is only built when solve_batch / solve_at_step first read it
+        # Crank-Nicolson operators, only built when scheme='crank_nicolson'
+        self.cn_solve = self.cn_rhs = None
+        if self.scheme == 'crank_nicolson':
+            self.cn_solve, self.cn_rhs = self.create_crank_nicolson()
         # create u vector for u_0 initial condition
         # create u vector for boundary condition
         self.u = self.initial_condition_vector()
@@ -27,70 +94,126 @@ class HeatEquation(object):
         # set boundary condition
         self.u_bound[0] = self.b0t
         self.u_bound[self.N - 1] = self.b1t
-        # create u matrix
-        self.u_matrix = np.zeros((self.N, self.len_t + 1))
+        # create u matrix, one row per time step, float32 storage
+        self.u_matrix = np.zeros((self.len_t + 1, self.N), dtype=np.float32)
         self.u_matrix = self.heat_equation_solver()
 
-    def initial_condition_vector(self):
-        u = np.zeros(self.N)
-        for i in range(0, self.N):
-            u[i] = self.u_0(i, self.delta_x)
-        return u
+    def initial_condition_vector(self, u_0=None):
+        # u_0 is called once with the whole index array, callables that
+        # only work on scalars fall back to np.vectorize
+        if u_0 is None:
+            u_0 = self.u_0
+        i = np.arange(self.N)
+        try:
+            u = u_0(i, self.delta_x)
+        except (TypeError, ValueError):
+            u = np.vectorize(u_0, otypes=[float])(i, self.delta_x)
+        # constant initial conditions (e.g. return 0) broadcast over the rod
+        return np.broadcast_to(u, (self.N,)).astype(float)
 
     def print_initial_condition_vector(self):
         return f"init condition vector = {self.u}"
 
     def sigma_checker(self):
+        if self.scheme == 'crank_nicolson':
+            return f"sigma = {self.sigma}, Crank-Nicolson is unconditionally stable"
         if self.sigma < 0.5:
             return f"sigma = {self.sigma} < 0.5 => The model should work"
         else:
             print(f"sigma = {self.sigma} >= 0.5 => The model doesn't work")
             exit()
 
+    @cached_property
+    def A(self):
+        return self.create_tri_diag()
+
     def create_tri_diag(self):
-        n = self.N
-        A = np.zeros((n, n))
-        for i in range(n):
-            if i == 0:
-                A[i][i + 1] = self.sigma
-            elif i == n - 1:
-                A[i][i - 1] = self.sigma
-            else:
-                A[i][i + 1] = self.sigma
-                A[i][i - 1] = self.sigma
-            A[i][i] = 1 - 2 * self.sigma
-        A[0,:] = 0
-        A[0, 0] = 1
-        A[n - 1, :] = 0
-        A[n - 1, n - 1] = 1
-        return A
+        return tri_diag_operator(self.N, self.sigma)
+
+    def create_crank_nicolson(self):
+        # (I - sigma/2 T) u_next = (I + sigma/2 T) u, both sides have the same
+        # shape as the explicit operator with sigma replaced by -sigma/2 and
+        # sigma/2. the left side is the same at every step so it is LU
+        # factorised once with LAPACK gttrf, leaving only the gttrs back
+        # substitution per step
+        lhs = tri_diag_operator(self.N, -self.sigma / 2)
+        dl, d, du = lhs.diagonal(-1), lhs.diagonal(), lhs.diagonal(1)
+        gttrf, gttrs = get_lapack_funcs(('gttrf', 'gttrs'), (dl, d, du))
+        dl, d, du, du2, ipiv, info = gttrf(dl, d, du)
+
+        def solve(b):
+            x, info = gttrs(dl, d, du, du2, ipiv, b)
+            return x
+
+        return solve, tri_diag_operator(self.N, self.sigma / 2)
 
     def print_tri_diag(self):
-        return f"A tri-diagonal = \n {self.A}"
+        return f"A tri-diagonal = \n {self.A.toarray()}"
 
     def heat_equation_solver(self):
         # set initial condition into the matrix
         # have to go back and check the 0 if it should be 1 or not
-        self.u_matrix[:, 0] = self.u
-        self.u_matrix[0, :] = self.u_bound[0]
-        self.u_matrix[self.N - 1, :] = self.u_bound[self.N - 1]
+        self.u_matrix[0, :] = self.u
+        self.u_matrix[:, 0] = self.u_bound[0]
+        self.u_matrix[:, self.N - 1] = self.u_bound[self.N - 1]
 
        # print("final u vector: ", self.u)
        # print(f"u bound vector: {self.u_bound}")
        # print(f"u matrix shape: {self.u_matrix.shape}")
-       # print(f"u matrix initial: {self.u_matrix[:, 0]}")
+       # print(f"u matrix initial: {self.u_matrix[0, :]}")
         # calculate u vector at each time step
+        # attributes are bound to locals once, the loops below run len_t times
+        u_matrix = self.u_matrix
+        if self.scheme == 'crank_nicolson':
+            cn_solve, cn_rhs = self.cn_solve, self.cn_rhs
+            for i in range(0, self.len_t):
+                u_matrix[i + 1] = cn_solve(cn_rhs @ u_matrix[i])
+            return u_matrix
+
+        sigma = u_matrix.dtype.type(self.sigma)
+        b_left, b_right = self.u_bound[0], self.u_bound[self.N - 1]
         for i in range(0, self.len_t):
             #self.u_matrix[:, i + 1] = np.dot(self.A, self.u_matrix[:, i]) + self.delta * self.u_bound
-            self.u_matrix[:, i + 1] = np.dot(self.A, self.u_matrix[:, i]) 
-            #print(f"u matrix at time step {i}: {self.u_matrix[:, i]}")
+            heat_step(u_matrix[i], u_matrix[i + 1], sigma, b_left, b_right)
+            #print(f"u matrix at time step {i}: {self.u_matrix[i]}")
             #time.sleep(0.8)
 
-        # set boundary condition into the matrix
+        return u_matrix
+
+    def solve_batch(self, initial_conditions):
+        # solve several initial conditions on the same rod together, each
+        # time step is one product against an (N, B) block instead of B
+        # separate matvecs, result[:, :, b] matches u_matrix for the b-th u_0
+        U = np.zeros((self.len_t + 1, self.N, len(initial_conditions)), dtype=np.float32)
+        for b, u_0 in enumerate(initial_conditions):
+            U[0, :, b] = self.initial_condition_vector(u_0)
+        U[:, 0, :] = self.u_bound[0]
+        U[:, self.N - 1, :] = self.u_bound[self.N - 1]
+
         for i in range(0, self.len_t):
-            self.u_matrix[0, i] = self.u_bound[0]
-            self.u_matrix[self.N - 1, i] = self.u_bound[self.N - 1]
-        return self.u_matrix
+            if self.scheme == 'crank_nicolson':
+                U[i + 1] = self.cn_solve(self.cn_rhs @ U[i])
+            else:
+                U[i + 1] = self.A @ U[i]
+        return U
+
+    def solve_at_step(self, k):
+        # jump straight to time step k as A^k u_0, matrix_power squares
+        # A repeatedly so this is log2(k) products instead of k matvecs.
+        # the identity boundary rows of A keep b0t and b1t fixed under powers
+        u = self.u.copy()
+        u[0] = self.u_bound[0]
+        u[self.N - 1] = self.u_bound[self.N - 1]
+        if self.scheme == 'crank_nicolson':
+            lhs = tri_diag_operator(self.N, -self.sigma / 2).toarray()
+            step = np.linalg.solve(lhs, self.cn_rhs.toarray())
+        else:
+            step = self.A.toarray()
+        return np.linalg.matrix_power(step, k) @ u
+
+    def energy_over_time(self):
+        # discrete integral of u^2 dx, one value per time step
+        return np.einsum('ij,ij->i', self.u_matrix, self.u_matrix, dtype=np.float64, optimize=True) * self.delta_x
 
     def print_u_matrix(self):
         return f"u matrix = \n {self.u_matrix}"
@@ -1,5 +1,5 @@
-import numpy
-from pylab import *
+import numpy as np
+from numpy import ceil, pi, sin
 import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d import Axes3D
 from heat_eq import HeatEquation
@@ -23,12 +23,13 @@ if __name__ == "__main__":
 
     # !CHANGE DIFFERENT CONDITIONS IN THE COMPONENTS HERE!
     L, T, b0t, b1t, beta, delta_t, delta_x = 1, 1, 20, 50, 1, 0.004, 0.1
+    # pass scheme='crank_nicolson' to drop the sigma < 0.5 restriction and use a larger delta_t
     heat_eq = HeatEquation(L, T, b0t, b1t, beta, delta_t, delta_x, initial_condition)
     print(heat_eq.sigma_checker())
     matrix = heat_eq.return_u_matrix()
 
-    print(f"matrix at x = 1/2, t = 1/2, {matrix[heat_eq.N // 2 ][heat_eq.len_t // 2]}")
-    print(f"matrix at x = 1/4, t = 1/2, {matrix[heat_eq.N // 4 ][heat_eq.len_t // 2]}")
+    print(f"matrix at x = 1/2, t = 1/2, {matrix[heat_eq.len_t // 2][heat_eq.N // 2]}")
+    print(f"matrix at x = 1/4, t = 1/2, {matrix[heat_eq.len_t // 2][heat_eq.N // 4]}")
 
     # plot 3d
 
@@ -37,10 +38,15 @@ if __name__ == "__main__":
     plt.rcParams['figure.autolayout'] = False
     X = np.arange(0, heat_eq.N, 1)
     Y = np.arange(1, heat_eq.len_t + 1, 1)
-    X, Y = np.meshgrid(X, Y)
-    Z = matrix[X, Y]
+    # sparse grids are a row and a column, the scaling below works on those
+    # and broadcast_arrays hands the plots full-size read-only views
+    X, Y = np.meshgrid(X, Y, sparse=True)
+    # rows 1..len_t as a view, same values as matrix[Y, X] without the
+    # fancy-index copy
+    Z = matrix[1:heat_eq.len_t + 1, :]
     x_scale = (X - X.min()) / (X.max() - X.min())
     t_scale = (Y - Y.min()) / (Y.max() - Y.min())
+    x_scale, t_scale, Y = np.broadcast_arrays(x_scale, t_scale, Y)
 
 
     fig = plt.figure(figsize=(8, 8), constrained_layout=True)
@@ -70,9 +76,12 @@ if __name__ == "__main__":
 
     #print(f'scale {scale}')
     scale = int(ceil(delta_x / delta_t ** 2 / 250 ** 2 * 2.5))
+    # every scale-th row is picked once as a contiguous block, each frame
+    # then reads one row of it instead of indexing the full matrix
+    frames_matrix = np.ascontiguousarray(matrix[:heat_eq.len_t:scale])
     def animate(i):
 
-        pcolor_subplot.set_array(matrix[:, i * scale])
+        pcolor_subplot.set_array(frames_matrix[i])
         # update label for y to reflect index i of time step
         ax3.set_ylabel(f"Time: {i * scale}")
         return pcolor_subplot,
@@ -92,12 +101,14 @@ if __name__ == "__main__":
         ax3.set_xlabel("delta_x")
         ax3.set_ylabel("Time")
         # label for Z
-        anim = animation.FuncAnimation(fig, animate, frames=heat_eq.len_t, interval= 150, blit=True)
+        anim = animation.FuncAnimation(fig, animate, frames=len(frames_matrix), interval= 150, blit=True)
     elif a == 'N':
         pass
     else:
         print("Invalid input, skipping animation")
     plt.show()
+    # release the figure and the surface/heatmap data it holds once shown
+    plt.close(fig)
 
 
 